@@ -46,32 +46,82 @@ get_node(Geometry *geometry, const unsigned int &i)
     return node_struct;
 }
 
+__device__ float3
+get_vertex(Geometry *geometry, const unsigned int &i)
+{
+    return make_float3(geometry->vertices_x[i], geometry->vertices_y[i],
+		       geometry->vertices_z[i]);
+}
+
+__device__ const unsigned int *
+get_triangle_tile(Geometry *geometry, const unsigned int &i)
+{
+    return geometry->triangles
+	+ (i / TRIANGLE_TILE_SIZE) * 4 * TRIANGLE_TILE_SIZE
+	+ (i % TRIANGLE_TILE_SIZE);
+}
+
+__device__ unsigned int
+get_material_code(Geometry *geometry, const unsigned int &i)
+{
+    return get_triangle_tile(geometry, i)[3*TRIANGLE_TILE_SIZE];
+}
+
 __device__ Triangle
 get_triangle(Geometry *geometry, const unsigned int &i)
 {
-    uint3 triangle_data = geometry->triangles[i];
+    const unsigned int *tile = get_triangle_tile(geometry, i);
 
     Triangle triangle;
-    triangle.v0 = geometry->vertices[triangle_data.x];
-    triangle.v1 = geometry->vertices[triangle_data.y];
-    triangle.v2 = geometry->vertices[triangle_data.z];
+    triangle.v0 = get_vertex(geometry, tile[0]);
+    triangle.v1 = get_vertex(geometry, tile[TRIANGLE_TILE_SIZE]);
+    triangle.v2 = get_vertex(geometry, tile[2*TRIANGLE_TILE_SIZE]);
 
     return triangle;
 }
 
-template <class T>
+/* The property tables are never written by the kernels, so they are read
+   through the read-only (texture) data cache, which keeps them from
+   evicting the ray and mesh data held in L1. */
+template <class P>
+__device__ P
+load_readonly(const P *p)
+{
+#if __CUDA_ARCH__ >= 350
+    return __ldg(p);
+#else
+    return *p;
+#endif
+}
+
+__device__ float
+property_value(const float *fp, const int &i)
+{
+    return load_readonly(fp + i);
+}
+
 __device__ float
-interp_property(T *m, const float &x, const float *fp)
+property_value(const unsigned short *fp, const int &i)
 {
-    if (x < m->wavelength_start)
-	return fp[0];
+    return load_readonly(fp + i) * (1.0f/65535.0f);
+}
+
+template <class T, class P>
+__device__ float
+interp_property(T *m, const float &x, const P *fp)
+{
+    if (x < WAVELENGTH_START(m))
+	return property_value(fp, 0);
+
+    if (x > (WAVELENGTH_START(m) + (WAVELENGTH_N(m)-1)*WAVELENGTH_STEP(m)))
+	return property_value(fp, WAVELENGTH_N(m)-1);
 
-    if (x > (m->wavelength_start + (m->wavelength_n-1)*m->wavelength_step))
-	return fp[m->wavelength_n-1];
+    int jl = (x-WAVELENGTH_START(m))/WAVELENGTH_STEP(m);
 
-    int jl = (x-m->wavelength_start)/m->wavelength_step;
+    float fl = property_value(fp, jl);
+    float fh = property_value(fp, jl+1);
 
-    return fp[jl] + (x-(m->wavelength_start + jl*m->wavelength_step))*(fp[jl+1]-fp[jl])/m->wavelength_step;
+    return fl + (x-(WAVELENGTH_START(m) + jl*WAVELENGTH_STEP(m)))*(fh-fl)/WAVELENGTH_STEP(m);
 }
 
 #endif
@@ -1,6 +1,20 @@
 #ifndef __GEOMETRY_TYPES_H__
 #define __GEOMETRY_TYPES_H__
 
+/* The wavelength grid shared by all materials and surfaces. If the grid
+   is fixed at compile time with WAVELEN_N, WAVELEN_STEP and WAVELEN_W0
+   (see GPUGeometry.cuda_options), the constants are used in place of the
+   values stored in each Material or Surface. */
+#ifdef WAVELEN_N
+#define WAVELENGTH_N(m) (WAVELEN_N)
+#define WAVELENGTH_STEP(m) (WAVELEN_STEP)
+#define WAVELENGTH_START(m) (WAVELEN_W0)
+#else
+#define WAVELENGTH_N(m) ((m)->wavelength_n)
+#define WAVELENGTH_STEP(m) ((m)->wavelength_step)
+#define WAVELENGTH_START(m) ((m)->wavelength_start)
+#endif
+
 struct Material
 {
     float *refractive_index;
@@ -29,13 +43,15 @@ struct DichroicProps
     unsigned int nangles;
 };
 
+/* the surface probabilities are stored as 16-bit unsigned normalized
+   integers, i.e. fractions of 65535 */
 struct Surface
 {
-    float *detect;
-    float *absorb;
-    float *reemit;
-    float *reflect_diffuse;
-    float *reflect_specular;
+    unsigned short *detect;
+    unsigned short *absorb;
+    unsigned short *reemit;
+    unsigned short *reflect_diffuse;
+    unsigned short *reflect_specular;
     float *eta;
     float *k;
     float *reemission_cdf;
@@ -58,6 +74,11 @@ enum { INTERNAL_NODE, LEAF_NODE, PADDING_NODE };
 const unsigned int CHILD_BITS = 28;
 const unsigned int NCHILD_MASK = (0xFFFFu << CHILD_BITS);
 
+/* triangles are stored in tiles of TRIANGLE_TILE_SIZE triangles holding
+   the three vertex indices and then the material codes of each triangle,
+   see to_aosoa32() in chroma/gpu/tools.py */
+const unsigned int TRIANGLE_TILE_SIZE = 32;
+
 struct Node
 {
     float3 lower;
@@ -68,9 +89,10 @@ struct Node
 
 struct Geometry
 {
-    float3 *vertices;
-    uint3 *triangles;
-    unsigned int *material_codes;
+    float *vertices_x;
+    float *vertices_y;
+    float *vertices_z;
+    unsigned int *triangles;
     unsigned int *colors;
     uint4 *primary_nodes;
     uint4 *extra_nodes;
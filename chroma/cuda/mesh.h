@@ -151,18 +151,35 @@ distance_to_mesh(int nthreads, float3 *_origin, float3 *_direction,
 }
 
 __global__ void
-color_solids(int first_triangle, int nthreads, int *solid_id_map,
-	     bool *solid_hit, unsigned int *solid_colors, Geometry *g)
+pack_material_codes(int ntriangles, unsigned char *material1_index,
+		    unsigned char *material2_index,
+		    unsigned char *surface_index, unsigned int *triangles)
 {
-    int id = blockIdx.x*blockDim.x + threadIdx.x;
+    int stride = gridDim.x*blockDim.x;
 
-    if (id >= nthreads)
-	return;
+    for (int i = blockIdx.x*blockDim.x + threadIdx.x; i < ntriangles;
+	 i += stride) {
+	unsigned int code = (((unsigned int) material1_index[i]) << 24) |
+	                    (((unsigned int) material2_index[i]) << 16) |
+	                    (((unsigned int) surface_index[i]) << 8);
+
+	triangles[(i / TRIANGLE_TILE_SIZE) * 4 * TRIANGLE_TILE_SIZE
+		  + 3 * TRIANGLE_TILE_SIZE + (i % TRIANGLE_TILE_SIZE)] = code;
+    }
+}
 
-    int triangle_id = first_triangle + id;
-    int solid_id = solid_id_map[triangle_id];
-    if (solid_hit[solid_id])
-	g->colors[triangle_id] = solid_colors[solid_id];
+__global__ void
+color_solids(int ntriangles, int *solid_id_map, bool *solid_hit,
+	     unsigned int *solid_colors, Geometry *g)
+{
+    int stride = gridDim.x*blockDim.x;
+
+    for (int triangle_id = blockIdx.x*blockDim.x + threadIdx.x;
+	 triangle_id < ntriangles; triangle_id += stride) {
+	int solid_id = solid_id_map[triangle_id];
+	if (solid_hit[solid_id])
+	    g->colors[triangle_id] = solid_colors[solid_id];
+    }
 }
 
 } // extern "C"
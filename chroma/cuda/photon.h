@@ -94,7 +94,7 @@ fill_state(State &s, Photon &p, Geometry *g)
 
     Triangle t = get_triangle(g, p.last_hit_triangle);
 
-    unsigned int material_code = g->material_codes[p.last_hit_triangle];
+    unsigned int material_code = get_material_code(g, p.last_hit_triangle);
 
     int inner_material_index = convert(0xFF & (material_code >> 24));
     int outer_material_index = convert(0xFF & (material_code >> 16));
@@ -254,9 +254,9 @@ int propagate_to_boundary(Photon &p, State &s, curandState &rng,
             float uniform_sample_reemit = curand_uniform(&rng);
             float comp_reemit_prob = interp_property(s.material1, p.wavelength, s.material1->comp_reemission_prob[comp]);
             if (uniform_sample_reemit < comp_reemit_prob) {
-                p.wavelength = sample_cdf(&rng, s.material1->wavelength_n, 
-                                          s.material1->wavelength_start,
-                                          s.material1->wavelength_step,
+                p.wavelength = sample_cdf(&rng, WAVELENGTH_N(s.material1),
+                                          WAVELENGTH_START(s.material1),
+                                          WAVELENGTH_STEP(s.material1),
                                           s.material1->comp_reemission_wvl_cdf[comp]);
                 p.time += sample_cdf(&rng, s.material1->time_n, 
                                           s.material1->time_start,
@@ -580,7 +580,7 @@ propagate_at_wls(Photon &p, State &s, curandState &rng, Surface *surface, bool u
         float uniform_sample_reemit = curand_uniform(&rng);
         if (uniform_sample_reemit < reemit) {
             p.history |= SURFACE_REEMIT;
-            p.wavelength = sample_cdf(&rng, surface->wavelength_n, surface->wavelength_start, surface->wavelength_step, surface->reemission_cdf);
+            p.wavelength = sample_cdf(&rng, WAVELENGTH_N(surface), WAVELENGTH_START(surface), WAVELENGTH_STEP(surface), surface->reemission_cdf);
             p.direction = uniform_sphere(&rng);
             p.polarization = cross(uniform_sphere(&rng), p.direction);
             p.polarization /= norm(p.polarization);
@@ -654,8 +654,9 @@ propagate_at_surface(Photon &p, State &s, curandState &rng, Geometry *geometry,
         // diffuse reflection, detection, and absorption based on relative
         // probabilties
 
-        // since the surface properties are interpolated linearly, we are
-        // guaranteed that they still sum to 1.0.
+        // the probabilities are quantized to 16 bits keeping their sum
+        // exact at every wavelength, and since they are interpolated
+        // linearly, we are guaranteed that they still sum to 1.0.
         float detect = interp_property(surface, p.wavelength, surface->detect);
         float absorb = interp_property(surface, p.wavelength, surface->absorb);
         float reflect_diffuse = interp_property(surface, p.wavelength, surface->reflect_diffuse);
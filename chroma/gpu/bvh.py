@@ -50,10 +50,10 @@ def create_leaf_nodes(mesh, morton_bits=16, round_to_multiple=1):
     # Put triangles and vertices in mapped host memory
     triangles = mapped_empty(shape=len(mesh.triangles), dtype=ga.vec.uint3,
                              write_combined=True)
-    triangles[:] = to_uint3(mesh.triangles)
+    to_uint3(mesh.triangles, out=triangles)
     vertices = mapped_empty(shape=len(mesh.vertices), dtype=ga.vec.float3,
                             write_combined=True)
-    vertices[:] = to_float3(mesh.vertices)
+    to_float3(mesh.vertices, out=vertices)
     
     # Call GPU to compute nodes
     nodes = ga.zeros(shape=round_up_to_multiple(len(triangles), 
@@ -1,12 +1,11 @@
 import numpy as np
 import pycuda.driver as cuda
 from pycuda import gpuarray as ga
-from pycuda import characterize
 
 from chroma.geometry import standard_wavelengths
-from chroma.gpu.tools import get_cu_module, get_cu_source, cuda_options, \
-    chunk_iterator, format_array, format_size, to_uint3, to_float3, \
-    make_gpu_struct
+from chroma.gpu.tools import get_cu_module, cuda_options, \
+    get_struct_sizes, chunk_iterator, format_array, format_size, to_uint3, \
+    to_float3, make_gpu_struct
 from chroma.log import logger
 
 from chroma.gpu.geometry import GPUGeometry
@@ -25,8 +24,8 @@ class GPUDetector(GPUGeometry):
         self.charge_cdf_x_gpu = ga.to_gpu(detector.charge_cdf[0].astype(np.float32))
         self.charge_cdf_y_gpu = ga.to_gpu(detector.charge_cdf[1].astype(np.float32))
 
-        detector_source = get_cu_source('detector.h')
-        detector_struct_size = characterize.sizeof('Detector', detector_source)
+        detector_struct_size = \
+            get_struct_sizes('detector.h', ('Detector',))['Detector']
         self.detector_gpu = make_gpu_struct(detector_struct_size,
                                             [self.solid_id_to_channel_index_gpu,
                                              self.time_cdf_x_gpu,
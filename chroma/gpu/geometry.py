@@ -1,42 +1,161 @@
 import numpy as np
 import pycuda.driver as cuda
 from pycuda import gpuarray as ga
-from pycuda import characterize
 
 from chroma.geometry import standard_wavelengths
-from chroma.gpu.tools import get_cu_module, get_cu_source, cuda_options, \
-    chunk_iterator, format_array, format_size, to_uint3, to_float3, \
-    make_gpu_struct, GPUFuncs, mapped_empty, Mapped
+from chroma.gpu.tools import get_cu_module, cuda_options, \
+    get_struct_sizes, format_array, format_size, to_aosoa32, \
+    make_gpu_struct, GPUFuncs, mapped_empty, Mapped, max_occupancy_config
 
 from chroma.log import logger
 
+def _interp_batch(x, props):
+    '''Linearly interpolate every (N,2) property table in `props` at the
+    points `x`, and return the results as a float32 array of shape
+    (len(props), len(x)).
+
+    Tables sharing the same abscissa are interpolated together, so the
+    bisection of `x` into the table is done once per distinct abscissa
+    rather than once per table. Values outside the table are clamped to
+    the end points, as with np.interp().'''
+    x = np.asarray(x)
+    out = np.empty((len(props), len(x)), dtype=np.float32)
+
+    groups = {}
+    for i, prop in enumerate(props):
+        xp = np.ascontiguousarray(prop[:,0])
+        groups.setdefault((xp.dtype.str, xp.tobytes()), []).append(i)
+
+    for rows in groups.values():
+        xp = props[rows[0]][:,0]
+        fp = np.array([props[i][:,1] for i in rows])
+
+        if len(xp) == 1:
+            out[rows] = fp[:,:1]
+            continue
+
+        idx = np.clip(np.searchsorted(xp, x, side='right') - 1, 0, len(xp)-2)
+        dx = xp[idx+1] - xp[idx]
+        frac = np.clip((x - xp[idx])/np.where(dx == 0, 1, dx), 0.0, 1.0)
+        out[rows] = fp[:,idx] + (fp[:,idx+1] - fp[:,idx])*frac
+
+    return out
+
+def _to_unorm16(x, axis=None):
+    '''Returns the fractions `x`, clipped to [0,1], as 16-bit unsigned
+    normalized integers, which the device reads back with
+    interp_property(). If `axis` is given, the running sum of `x` along
+    `axis` is rounded and the differences are returned instead, so that
+    fractions which sum to one along `axis` still sum to exactly 65535.'''
+    x = np.clip(x, 0.0, 1.0)
+    if axis is None:
+        return np.rint(x*65535).astype(np.uint16)
+    total = np.clip(np.cumsum(x, axis=axis, dtype=np.float64), 0.0, 1.0)
+    return np.diff(np.rint(total*65535), axis=axis,
+                   prepend=0).astype(np.uint16)
+
+def _pinned_to_gpu(arr, stream, dtype=None):
+    '''Queue a copy of `arr` into a new GPUArray on `stream`, staging it
+    through page-locked host memory so the transfer can be done by DMA.
+    If `dtype` is given, `arr` is cast while it is copied into the
+    staging buffer, so no intermediate host copy is made.
+
+    Returns the GPUArray and the staging buffer, which must be kept alive
+    until `stream` has been synchronized. Empty arrays need neither, since
+    the driver refuses zero-byte allocations, and the buffer is None.'''
+    if dtype is None:
+        dtype = arr.dtype
+    else:
+        dtype = np.dtype(dtype)
+
+    if arr.size == 0:
+        return ga.empty(arr.shape, dtype), None
+
+    if hasattr(arr.base, 'get_device_pointer') and arr.dtype == dtype:
+        # already page-locked, see Mapped()
+        buf = arr
+    else:
+        buf = cuda.pagelocked_empty(arr.shape, dtype)
+        buf[...] = arr
+
+    arr_gpu = ga.empty(arr.shape, dtype)
+    cuda.memcpy_htod_async(arr_gpu.gpudata, buf, stream)
+    return arr_gpu, buf
+
+def _row_pointers(arr_gpu):
+    '''Returns the device pointers to each row of the 2D GPUArray
+    `arr_gpu`, to be passed as members to make_gpu_struct().'''
+    if arr_gpu.size == 0:
+        return []
+    base = int(arr_gpu.gpudata)
+    return [np.intp(base + i*arr_gpu.strides[0])
+            for i in range(arr_gpu.shape[0])]
+
+def _uniform_step(x, name):
+    '''Return the spacing of the equally spaced array `x`, raising a
+    ValueError naming it `name` otherwise.'''
+    d = np.diff(x)
+    if len(d) == 0 or np.ptp(d) > 1e-6*abs(d[0]):
+        raise ValueError('%s must be equally spaced apart.' % name)
+    return float(d[0])
+
 class GPUGeometry(object):
     def __init__(self, geometry, wavelengths=None, times=None, print_usage=False, min_free_gpu_mem=300e6):
         if wavelengths is None:
             wavelengths = standard_wavelengths
 
-        try:
-            wavelength_step = np.unique(np.diff(wavelengths)).item()
-        except ValueError:
-            raise ValueError('wavelengths must be equally spaced apart.')
+        if wavelengths is standard_wavelengths:
+            wavelength_step = float(standard_wavelengths[1] -
+                                    standard_wavelengths[0])
+        else:
+            wavelength_step = _uniform_step(wavelengths, 'wavelengths')
             
         if times is None:
             time_step = 0.05
             times = np.arange(0,1000,time_step)
         else:
-            try:
-                time_step = np.unique(np.diff(times)).item()
-            except ValueError:
-                raise ValueError('times must be equally spaced apart.')
-
-        geometry_source = get_cu_source('geometry_types.h')
-        material_struct_size = characterize.sizeof('Material', geometry_source)
-        surface_struct_size = characterize.sizeof('Surface', geometry_source)
-        dichroicprops_struct_size = characterize.sizeof('DichroicProps', geometry_source)
-        geometry_struct_size = characterize.sizeof('Geometry', geometry_source)
-
-        self.material_data = []
-        self.material_ptrs = []
+            time_step = _uniform_step(times, 'times')
+
+        struct_sizes = get_struct_sizes('geometry_types.h',
+                                        ('Material', 'Surface',
+                                         'DichroicProps', 'Geometry'))
+        material_struct_size = struct_sizes['Material']
+        surface_struct_size = struct_sizes['Surface']
+        dichroicprops_struct_size = struct_sizes['DichroicProps']
+        geometry_struct_size = struct_sizes['Geometry']
+
+        # options to compile kernels that use this geometry's material and
+        # surface properties with the wavelength grid as constants
+        self.cuda_options = cuda_options + \
+            ('-DWAVELEN_N=%d' % len(wavelengths),
+             '-DWAVELEN_STEP=%.9ef' % wavelength_step,
+             '-DWAVELEN_W0=%.9ef' % wavelengths[0])
+
+        self._mesh_module = get_cu_module('mesh.h', options=cuda_options)
+        self._color_solids_fn = self._mesh_module.get_function('color_solids')
+        self._color_solids_fn.prepare('iPPPP')
+        self._cs_block, self._cs_grid_max = \
+            max_occupancy_config(self._color_solids_fn)
+        # page-locked and device buffer pairs reused by color_solids()
+        self._color_staging = {}
+
+        # all host to device copies are queued on one stream, staged
+        # through page-locked buffers that are held until it is synced.
+        # the structs pointing at the uploaded arrays are only written
+        # after the sync, since make_gpu_struct() copies on the default
+        # stream, which would otherwise serialize the queued copies.
+        self._upload_stream = cuda.Stream()
+        staging_buffers = []
+
+        def to_gpu(arr, dtype=None):
+            arr_gpu, buf = _pinned_to_gpu(arr, self._upload_stream, dtype)
+            staging_buffers.append(buf)
+            return arr_gpu
+
+        def make_pointer_array(arrays):
+            if len(arrays) == 0:
+                return np.uint64(0) #NULL
+            return make_gpu_struct(8*len(arrays), arrays)
 
         def interp_material_property(wavelengths, property):
             # note that it is essential that the material properties be
@@ -44,42 +163,189 @@ class GPUGeometry(object):
             # code to guarantee that probabilities still sum to one.
             return np.interp(wavelengths, property[:,0], property[:,1]).astype(np.float32)
 
+        if any(material is None for material in geometry.unique_materials):
+            raise Exception('one or more triangles is missing a material.')
+
+        # the fixed per-material properties are interpolated in one batch
+        # and uploaded as a single [material][property][wavelength] table
+        material_props = \
+            _interp_batch(wavelengths,
+                          [prop for material in geometry.unique_materials
+                           for prop in (material.refractive_index,
+                                        material.absorption_length,
+                                        material.scattering_length)])
+        self._material_storage = to_gpu(material_props)
+
+        material_uploads = []
         for i in range(len(geometry.unique_materials)):
             material = geometry.unique_materials[i]
 
-            if material is None:
-                raise Exception('one or more triangles is missing a material.')
-
-            refractive_index = interp_material_property(wavelengths, material.refractive_index)
-            refractive_index_gpu = ga.to_gpu(refractive_index)
-            absorption_length = interp_material_property(wavelengths, material.absorption_length)
-            absorption_length_gpu = ga.to_gpu(absorption_length)
-            scattering_length = interp_material_property(wavelengths, material.scattering_length)
-            scattering_length_gpu = ga.to_gpu(scattering_length)
             num_comp = len(material.comp_reemission_prob)
-            comp_reemission_prob_gpu = [ga.to_gpu(interp_material_property(wavelengths, component)) for component in material.comp_reemission_prob]
-            self.material_data.append(comp_reemission_prob_gpu)
-            comp_reemission_prob_gpu = np.uint64(0) if len(comp_reemission_prob_gpu) == 0 else make_gpu_struct(8*len(comp_reemission_prob_gpu), comp_reemission_prob_gpu)
             assert num_comp == len(material.comp_reemission_wvl_cdf), 'component arrays must be same length'
-            comp_reemission_wvl_cdf_gpu = [ga.to_gpu(interp_material_property(wavelengths, component)) for component in material.comp_reemission_wvl_cdf]
-            self.material_data.append(comp_reemission_wvl_cdf_gpu)
-            comp_reemission_wvl_cdf_gpu = np.uint64(0) if len(comp_reemission_wvl_cdf_gpu) == 0 else make_gpu_struct(8*len(comp_reemission_wvl_cdf_gpu), comp_reemission_wvl_cdf_gpu)
             assert num_comp == len(material.comp_reemission_time_cdf), 'component arrays must be same length'
-            comp_reemission_time_cdf_gpu = [ga.to_gpu(interp_material_property(times, component)) for component in material.comp_reemission_time_cdf]
-            self.material_data.append(comp_reemission_time_cdf_gpu)
-            comp_reemission_time_cdf_gpu = np.uint64(0) if len(comp_reemission_time_cdf_gpu) == 0 else make_gpu_struct(8*len(comp_reemission_time_cdf_gpu), comp_reemission_time_cdf_gpu)
             assert num_comp == len(material.comp_absorption_length), 'component arrays must be same length'
-            comp_absorption_length_gpu = [ga.to_gpu(interp_material_property(wavelengths, component)) for component in material.comp_absorption_length]
-            self.material_data.append(comp_absorption_length_gpu)
-            comp_absorption_length_gpu = np.uint64(0) if len(comp_absorption_length_gpu) == 0 else make_gpu_struct(8*len(comp_absorption_length_gpu), comp_absorption_length_gpu)
-
-            self.material_data.append(refractive_index_gpu)
-            self.material_data.append(absorption_length_gpu)
-            self.material_data.append(scattering_length_gpu)
-            self.material_data.append(comp_reemission_prob_gpu)
-            self.material_data.append(comp_reemission_wvl_cdf_gpu)
-            self.material_data.append(comp_reemission_time_cdf_gpu)
-            self.material_data.append(comp_absorption_length_gpu)
+
+            material_uploads.append(
+                ([to_gpu(interp_material_property(wavelengths, component)) for component in material.comp_reemission_prob],
+                 [to_gpu(interp_material_property(wavelengths, component)) for component in material.comp_reemission_wvl_cdf],
+                 [to_gpu(interp_material_property(times, component)) for component in material.comp_reemission_time_cdf],
+                 [to_gpu(interp_material_property(wavelengths, component)) for component in material.comp_absorption_length]))
+
+        # likewise for the fixed per-surface properties, skipping the
+        # placeholder surfaces
+        surface_props = \
+            _interp_batch(wavelengths,
+                          [prop for surface in geometry.unique_surfaces
+                           if surface is not None
+                           for prop in (surface.detect, surface.absorb,
+                                        surface.reemit,
+                                        surface.reflect_diffuse,
+                                        surface.reflect_specular,
+                                        surface.eta, surface.k,
+                                        surface.reemission_cdf)])
+        surface_props = surface_props.reshape(-1, 8, len(wavelengths))
+
+        # the detect, absorb, reemit and reflect probabilities are stored
+        # as 16-bit fractions, halving the bytes read per lookup. eta, k
+        # and the reemission cdf are not bounded by one and stay float32.
+        # detect, absorb and the two reflect probabilities are quantized
+        # together so that they keep their sum, which propagate_at_surface()
+        # relies on; reemit is conditional on absorption.
+        surface_probabilities = np.empty(surface_props[:,:5].shape, np.uint16)
+        surface_probabilities[:,[0,1,3,4]] = \
+            _to_unorm16(surface_props[:,[0,1,3,4]], axis=1)
+        surface_probabilities[:,2] = _to_unorm16(surface_props[:,2])
+        self._surface_probabilities = \
+            to_gpu(surface_probabilities.reshape(-1, len(wavelengths)))
+        self._surface_storage = \
+            to_gpu(surface_props[:,5:].reshape(-1, len(wavelengths)))
+
+        surface_uploads = []
+        for i in range(len(geometry.unique_surfaces)):
+            surface = geometry.unique_surfaces[i]
+
+            if surface is None:
+                surface_uploads.append(None)
+                continue
+
+            if surface.dichroic_props:
+                props = surface.dichroic_props
+                dichroic_gpu = \
+                    (to_gpu(props.angles, dtype=np.float32),
+                     [to_gpu(interp_material_property(wavelengths, props.dichroic_reflect[i])) for i in range(len(props.angles))],
+                     [to_gpu(interp_material_property(wavelengths, props.dichroic_transmit[i])) for i in range(len(props.angles))])
+            else:
+                dichroic_gpu = None
+
+            surface_uploads.append(dichroic_gpu)
+
+        # vertices are stored as separate x, y and z columns so that
+        # neighboring threads make coalesced loads
+        self.vertices = tuple(mapped_empty(shape=len(geometry.mesh.vertices),
+                                           dtype=np.float32,
+                                           write_combined=True)
+                              for _ in range(3))
+        for i in range(3):
+            self.vertices[i][:] = geometry.mesh.vertices[:,i]
+        
+        self.world_origin = ga.vec.make_float3(*geometry.bvh.world_coords.world_origin)
+        self.world_scale = np.float32(geometry.bvh.world_coords.world_scale)
+
+        # the triangle vertex indices and material codes are read
+        # together, so they are interleaved in tiles of 32 triangles.
+        # the material codes are filled in on the device below.
+        ntriangles = len(geometry.mesh.triangles)
+        self.triangles = mapped_empty(shape=((ntriangles + 31) // 32,4,32),
+                                      dtype=np.uint32, write_combined=True)
+        to_aosoa32(geometry.mesh.triangles, out=self.triangles)
+
+        self.colors = to_gpu(geometry.colors, dtype=np.uint32)
+        # pristine copy of the colors on the device for reset_colors()
+        self._pristine_colors = ga.empty_like(self.colors)
+        cuda.memcpy_dtod_async(self._pristine_colors.gpudata,
+                               self.colors.gpudata, self.colors.nbytes,
+                               self._upload_stream)
+        self.solid_id_map = to_gpu(geometry.solid_id, dtype=np.uint32)
+
+        # Limit memory usage by splitting BVH into on and off-GPU parts
+        gpu_free, gpu_total = cuda.mem_get_info()
+        node_array_usage = geometry.bvh.nodes.nbytes
+
+        # Figure out how many elements we can fit on the GPU,
+        # but no fewer than 100 elements, and no more than the number of actual nodes
+        n_nodes = len(geometry.bvh.nodes)
+        split_index = min(
+            max(int((gpu_free - min_free_gpu_mem) / geometry.bvh.nodes.itemsize),100),
+            n_nodes
+            )
+        
+        self.nodes = to_gpu(geometry.bvh.nodes[:split_index])
+        n_extra = max(1, (n_nodes - split_index)) # forbid zero size
+        self.extra_nodes = mapped_empty(shape=n_extra,
+                                        dtype=geometry.bvh.nodes.dtype,
+                                        write_combined=True)
+        if split_index < n_nodes:
+            logger.info('Splitting BVH between GPU and CPU memory at node %d' % split_index)
+            self.extra_nodes[:] = geometry.bvh.nodes[split_index:]
+
+        # See if there is enough memory to put the and/ortriangles back on the GPU
+        gpu_free, gpu_total = cuda.mem_get_info()
+        if self.triangles.nbytes < (gpu_free - min_free_gpu_mem):
+            self.triangles = to_gpu(self.triangles)
+            logger.info('Optimization: Sufficient memory to move triangles onto GPU')
+
+        gpu_free, gpu_total = cuda.mem_get_info()
+        if sum(x.nbytes for x in self.vertices) < (gpu_free - min_free_gpu_mem):
+            self.vertices = tuple(to_gpu(x) for x in self.vertices)
+            logger.info('Optimization: Sufficient memory to move vertices onto GPU')
+
+        # the material codes are derived from the 8-bit material and
+        # surface indices of each triangle, so only those are uploaded and
+        # the codes are packed into the triangle tiles on the device
+        material_indices_gpu = [to_gpu(index, dtype=np.uint8) for index in
+                                (geometry.material1_index,
+                                 geometry.material2_index,
+                                 geometry.surface_index)]
+        pack_material_codes = \
+            self._mesh_module.get_function('pack_material_codes')
+        nthreads_per_block, max_blocks = \
+            max_occupancy_config(pack_material_codes)
+        blocks = min(max_blocks,
+                     (ntriangles + nthreads_per_block - 1) // nthreads_per_block)
+        pack_material_codes(np.int32(ntriangles), *material_indices_gpu,
+                            Mapped(self.triangles),
+                            block=(nthreads_per_block,1,1),
+                            grid=(max(blocks,1),1),
+                            stream=self._upload_stream)
+
+        self._upload_stream.synchronize()
+        del staging_buffers[:]
+        del material_indices_gpu
+
+        # the component and dichroic tables and the pointer arrays to
+        # them, kept alive for the structs that point at them
+        self._device_data = []
+        self.material_ptrs = []
+
+        material_props_gpu = _row_pointers(self._material_storage)
+
+        for i, (comp_reemission_prob, comp_reemission_wvl_cdf,
+                comp_reemission_time_cdf, comp_absorption_length) in \
+                enumerate(material_uploads):
+            refractive_index_gpu, absorption_length_gpu, \
+                scattering_length_gpu = material_props_gpu[3*i:3*i+3]
+
+            self._device_data.append(material_uploads[i])
+
+            comp_reemission_prob_gpu = make_pointer_array(comp_reemission_prob)
+            comp_reemission_wvl_cdf_gpu = make_pointer_array(comp_reemission_wvl_cdf)
+            comp_reemission_time_cdf_gpu = make_pointer_array(comp_reemission_time_cdf)
+            comp_absorption_length_gpu = make_pointer_array(comp_absorption_length)
+
+            self._device_data.extend([comp_reemission_prob_gpu,
+                                      comp_reemission_wvl_cdf_gpu,
+                                      comp_reemission_time_cdf_gpu,
+                                      comp_absorption_length_gpu])
 
             material_gpu = \
                 make_gpu_struct(material_struct_size,
@@ -89,7 +355,7 @@ class GPUGeometry(object):
                                  comp_reemission_wvl_cdf_gpu,
                                  comp_reemission_time_cdf_gpu,
                                  comp_absorption_length_gpu,
-                                 np.uint32(num_comp),
+                                 np.uint32(len(comp_reemission_prob)),
                                  np.uint32(len(wavelengths)),
                                  np.float32(wavelength_step),
                                  np.float32(wavelengths[0]),
@@ -102,12 +368,12 @@ class GPUGeometry(object):
         self.material_pointer_array = \
             make_gpu_struct(8*len(self.material_ptrs), self.material_ptrs)
 
-        self.surface_data = []
         self.surface_ptrs = []
 
-        for i in range(len(geometry.unique_surfaces)):
-            surface = geometry.unique_surfaces[i]
+        surface_probabilities_gpu = iter(_row_pointers(self._surface_probabilities))
+        surface_props_gpu = iter(_row_pointers(self._surface_storage))
 
+        for surface, dichroic_gpu in zip(geometry.unique_surfaces, surface_uploads):
             if surface is None:
                 # need something to copy to the surface array struct
                 # that is the same size as a 64-bit pointer.
@@ -115,59 +381,24 @@ class GPUGeometry(object):
                 self.surface_ptrs.append(np.uint64(0))
                 continue
 
-            detect = interp_material_property(wavelengths, surface.detect)
-            detect_gpu = ga.to_gpu(detect)
-            absorb = interp_material_property(wavelengths, surface.absorb)
-            absorb_gpu = ga.to_gpu(absorb)
-            reemit = interp_material_property(wavelengths, surface.reemit)
-            reemit_gpu = ga.to_gpu(reemit)
-            reflect_diffuse = interp_material_property(wavelengths, surface.reflect_diffuse)
-            reflect_diffuse_gpu = ga.to_gpu(reflect_diffuse)
-            reflect_specular = interp_material_property(wavelengths, surface.reflect_specular)
-            reflect_specular_gpu = ga.to_gpu(reflect_specular)
-            eta = interp_material_property(wavelengths, surface.eta)
-            eta_gpu = ga.to_gpu(eta)
-            k = interp_material_property(wavelengths, surface.k)
-            k_gpu = ga.to_gpu(k)
-            reemission_cdf = interp_material_property(wavelengths, surface.reemission_cdf)
-            reemission_cdf_gpu = ga.to_gpu(reemission_cdf)
-            
-            if surface.dichroic_props:
-                props = surface.dichroic_props
-                transmit_pointers = []
-                reflect_pointers = []
-                angles_gpu = ga.to_gpu(np.asarray(props.angles,dtype=np.float32))
-                self.surface_data.append(angles_gpu)
-                
-                for i,angle in enumerate(props.angles):
-                    dichroic_reflect = interp_material_property(wavelengths, props.dichroic_reflect[i])
-                    dichroic_reflect_gpu = ga.to_gpu(dichroic_reflect)
-                    self.surface_data.append(dichroic_reflect_gpu)
-                    reflect_pointers.append(dichroic_reflect_gpu)
-                    
-                    dichroic_transmit = interp_material_property(wavelengths, props.dichroic_transmit[i])
-                    dichroic_transmit_gpu = ga.to_gpu(dichroic_transmit)
-                    self.surface_data.append(dichroic_transmit_gpu)
-                    transmit_pointers.append(dichroic_transmit_gpu)
-                
+            detect_gpu, absorb_gpu, reemit_gpu, reflect_diffuse_gpu, \
+                reflect_specular_gpu = \
+                [next(surface_probabilities_gpu) for _ in range(5)]
+            eta_gpu, k_gpu, reemission_cdf_gpu = \
+                [next(surface_props_gpu) for _ in range(3)]
+
+            if dichroic_gpu is not None:
+                angles_gpu, reflect_pointers, transmit_pointers = dichroic_gpu
+                self._device_data.append(dichroic_gpu)
+
                 reflect_arr_gpu = make_gpu_struct(8*len(reflect_pointers),reflect_pointers)
-                self.surface_data.append(reflect_arr_gpu)
                 transmit_arr_gpu = make_gpu_struct(8*len(transmit_pointers), transmit_pointers)
-                self.surface_data.append(transmit_arr_gpu)
-                dichroic_props = make_gpu_struct(dichroicprops_struct_size,[angles_gpu,reflect_arr_gpu,transmit_arr_gpu,np.uint32(len(props.angles))])
+                self._device_data.extend([reflect_arr_gpu, transmit_arr_gpu])
+                dichroic_props = make_gpu_struct(dichroicprops_struct_size,[angles_gpu,reflect_arr_gpu,transmit_arr_gpu,np.uint32(angles_gpu.size)])
             else:
                 dichroic_props = np.uint64(0) #NULL
-            
-            
 
-            self.surface_data.append(detect_gpu)
-            self.surface_data.append(absorb_gpu)
-            self.surface_data.append(reemit_gpu)
-            self.surface_data.append(reflect_diffuse_gpu)
-            self.surface_data.append(reflect_specular_gpu)
-            self.surface_data.append(eta_gpu)
-            self.surface_data.append(k_gpu)
-            self.surface_data.append(dichroic_props)
+            self._device_data.append(dichroic_props)
             
             surface_gpu = \
                 make_gpu_struct(surface_struct_size,
@@ -187,62 +418,11 @@ class GPUGeometry(object):
         self.surface_pointer_array = \
             make_gpu_struct(8*len(self.surface_ptrs), self.surface_ptrs)
 
-        self.vertices = mapped_empty(shape=len(geometry.mesh.vertices),
-                                     dtype=ga.vec.float3,
-                                     write_combined=True)
-        self.triangles = mapped_empty(shape=len(geometry.mesh.triangles),
-                                      dtype=ga.vec.uint3,
-                                      write_combined=True)
-        self.vertices[:] = to_float3(geometry.mesh.vertices)
-        self.triangles[:] = to_uint3(geometry.mesh.triangles)
-        
-        self.world_origin = ga.vec.make_float3(*geometry.bvh.world_coords.world_origin)
-        self.world_scale = np.float32(geometry.bvh.world_coords.world_scale)
-
-        material_codes = (((geometry.material1_index & 0xff) << 24) |
-                          ((geometry.material2_index & 0xff) << 16) |
-                          ((geometry.surface_index & 0xff) << 8)).astype(np.uint32)
-        self.material_codes = ga.to_gpu(material_codes)
-        colors = geometry.colors.astype(np.uint32)
-        self.colors = ga.to_gpu(colors)
-        self.solid_id_map = ga.to_gpu(geometry.solid_id.astype(np.uint32))
-
-        # Limit memory usage by splitting BVH into on and off-GPU parts
-        gpu_free, gpu_total = cuda.mem_get_info()
-        node_array_usage = geometry.bvh.nodes.nbytes
-
-        # Figure out how many elements we can fit on the GPU,
-        # but no fewer than 100 elements, and no more than the number of actual nodes
-        n_nodes = len(geometry.bvh.nodes)
-        split_index = min(
-            max(int((gpu_free - min_free_gpu_mem) / geometry.bvh.nodes.itemsize),100),
-            n_nodes
-            )
-        
-        self.nodes = ga.to_gpu(geometry.bvh.nodes[:split_index])
-        n_extra = max(1, (n_nodes - split_index)) # forbid zero size
-        self.extra_nodes = mapped_empty(shape=n_extra,
-                                        dtype=geometry.bvh.nodes.dtype,
-                                        write_combined=True)
-        if split_index < n_nodes:
-            logger.info('Splitting BVH between GPU and CPU memory at node %d' % split_index)
-            self.extra_nodes[:] = geometry.bvh.nodes[split_index:]
-
-        # See if there is enough memory to put the and/ortriangles back on the GPU
-        gpu_free, gpu_total = cuda.mem_get_info()
-        if self.triangles.nbytes < (gpu_free - min_free_gpu_mem):
-            self.triangles = ga.to_gpu(self.triangles)
-            logger.info('Optimization: Sufficient memory to move triangles onto GPU')
-
-        gpu_free, gpu_total = cuda.mem_get_info()
-        if self.vertices.nbytes < (gpu_free - min_free_gpu_mem):
-            self.vertices = ga.to_gpu(self.vertices)
-            logger.info('Optimization: Sufficient memory to move vertices onto GPU')
-
         self.gpudata = make_gpu_struct(geometry_struct_size,
-                                       [Mapped(self.vertices), 
+                                       [Mapped(self.vertices[0]),
+                                        Mapped(self.vertices[1]),
+                                        Mapped(self.vertices[2]),
                                         Mapped(self.triangles),
-                                        self.material_codes,
                                         self.colors, self.nodes,
                                         Mapped(self.extra_nodes),
                                         self.material_pointer_array,
@@ -251,7 +431,9 @@ class GPUGeometry(object):
                                         self.world_scale,
                                         np.int32(len(self.nodes))])
 
-        self.geometry = geometry
+        # only the triangle count is needed after construction, so the
+        # host geometry is not kept alive
+        self._ntri = ntriangles
 
         if print_usage:
             self.print_device_usage()
@@ -277,22 +459,52 @@ class GPUGeometry(object):
         print() 
 
     def reset_colors(self):
-        self.colors.set_async(self.geometry.colors.astype(np.uint32))
-
-    def color_solids(self, solid_hit, colors, nblocks_per_thread=64,
-                     max_blocks=1024):
-        solid_hit_gpu = ga.to_gpu(np.array(solid_hit, dtype=np.bool))
-        solid_colors_gpu = ga.to_gpu(np.array(colors, dtype=np.uint32))
-
-        module = get_cu_module('mesh.h', options=cuda_options)
-        color_solids = module.get_function('color_solids')
-
-        for first_triangle, triangles_this_round, blocks in \
-                chunk_iterator(self.triangles.size, nblocks_per_thread,
-                               max_blocks):
-            color_solids(np.int32(first_triangle),
-                         np.int32(triangles_this_round), self.solid_id_map,
-                         solid_hit_gpu, solid_colors_gpu, self.gpudata,
-                         block=(nblocks_per_thread,1,1), 
-                         grid=(blocks,1))
+        cuda.memcpy_dtod_async(self.colors.gpudata,
+                               self._pristine_colors.gpudata,
+                               self.colors.nbytes, self._upload_stream)
+
+    def _stage(self, name, values, dtype):
+        '''Queue a copy of `values` to the device on the upload stream,
+        through the page-locked and device buffers kept under `name`,
+        which are reallocated only if the shape changes. Returns the
+        device array.'''
+        values = np.asarray(values)
+        if values.size == 0:
+            # the driver refuses zero-byte page-locked allocations
+            return ga.empty(values.shape, dtype)
+
+        if name not in self._color_staging or \
+                self._color_staging[name][0].shape != values.shape:
+            self._color_staging[name] = \
+                (cuda.pagelocked_empty(values.shape, dtype),
+                 ga.empty(values.shape, dtype))
+
+        host, device = self._color_staging[name]
+        np.copyto(host, values, casting='unsafe')
+        cuda.memcpy_htod_async(device.gpudata, host, self._upload_stream)
+        return device
+
+    def color_solids(self, solid_hit, colors, nblocks_per_thread=None,
+                     max_blocks=None):
+        '''Set the color of every triangle of each solid with a true entry
+        in `solid_hit` to that solid's entry in `colors`. This is done in a
+        single launch of at most `max_blocks` blocks looping over the
+        triangles, which defaults to the grid that fully occupies the
+        device.'''
+        if nblocks_per_thread is None:
+            nblocks_per_thread = self._cs_block
+        if max_blocks is None:
+            max_blocks = self._cs_grid_max
+
+        # the staging buffers may still be in use by the previous call
+        self._upload_stream.synchronize()
+        solid_hit_gpu = self._stage('solid_hit', solid_hit, np.bool_)
+        solid_colors_gpu = self._stage('colors', colors, np.uint32)
+
+        blocks = min(max_blocks,
+                     (self._ntri + nblocks_per_thread - 1) // nblocks_per_thread)
+        self._color_solids_fn.prepared_async_call(
+            (max(blocks,1),1), (nblocks_per_thread,1,1), self._upload_stream,
+            np.int32(self._ntri), self.solid_id_map.gpudata,
+            solid_hit_gpu.gpudata, solid_colors_gpu.gpudata, self.gpudata)
 
@@ -3,6 +3,7 @@ import sys
 import gc
 from pycuda import gpuarray as ga
 import pycuda.driver as cuda
+import pycuda.tools
 
 from chroma.tools import profile_if_possible
 from chroma import event
@@ -10,6 +11,12 @@ from chroma.gpu.tools import get_cu_module, cuda_options, GPUFuncs, \
     chunk_iterator, to_float3
 
 
+@pycuda.tools.context_dependent_memoize
+def _get_propagate_funcs(options):
+    '''Returns the propagate.cu functions compiled with `options`, which
+    are specialized for a geometry by GPUGeometry.cuda_options.'''
+    return GPUFuncs(get_cu_module('propagate.cu', options=options))
+
 class GPUPhotons(object):
     def __init__(self, photons, ncopies=1, copy_flags=True, copy_triangles=True, copy_weights=True):
         """Load ``photons`` onto the GPU, replicating as requested.
@@ -205,6 +212,7 @@ class GPUPhotons(object):
         """
         nphotons = self.pos.size
         step = 0
+        propagate_funcs = _get_propagate_funcs(gpu_geometry.cuda_options)
         input_queue = np.empty(shape=nphotons+1, dtype=np.uint32)
         input_queue[0] = 0
         # Order photons initially in the queue to put the clones next to each other
@@ -231,7 +239,7 @@ class GPUPhotons(object):
 
             for first_photon, photons_this_round, blocks in \
                     chunk_iterator(nphotons, nthreads_per_block, max_blocks):
-                self.gpu_funcs.propagate(np.int32(first_photon), np.int32(photons_this_round), input_queue_gpu[1:], output_queue_gpu, rng_states, self.pos, self.dir, self.wavelengths, self.pol, self.t, self.flags, self.last_hit_triangles, self.weights, self.evidx, np.int32(nsteps), np.int32(use_weights), np.int32(scatter_first), gpu_geometry.gpudata, block=(nthreads_per_block,1,1), grid=(blocks, 1))
+                propagate_funcs.propagate(np.int32(first_photon), np.int32(photons_this_round), input_queue_gpu[1:], output_queue_gpu, rng_states, self.pos, self.dir, self.wavelengths, self.pol, self.t, self.flags, self.last_hit_triangles, self.weights, self.evidx, np.int32(nsteps), np.int32(use_weights), np.int32(scatter_first), gpu_geometry.gpudata, block=(nthreads_per_block,1,1), grid=(blocks, 1))
             
             if track: #save the next step for all photons in the input queue
                 step_photon_ids.append(input_queue_gpu[1:nphotons+1].get())
@@ -39,6 +39,31 @@ def get_cu_source(name):
         source = f.read()
     return source
 
+@pytools.memoize
+def get_struct_sizes(name, type_names):
+    """Returns a dictionary mapping each of the types in `type_names` to its
+    size in bytes on the device, where the types are declared in the CUDA
+    source file cuda/[name]. Unlike pycuda.characterize.sizeof(), all of
+    the sizes are found with a single compile, and the result is cached
+    for the life of the process rather than per context."""
+    lines = ['    sizes[%d] = sizeof(%s);' % (i, type_name)
+             for i, type_name in enumerate(type_names)]
+    source = get_cu_source(name) + """
+extern "C" __global__ void
+get_struct_sizes(unsigned int *sizes)
+{
+%s
+}
+""" % '\n'.join(lines)
+
+    module = pycuda.compiler.SourceModule(source, options=['-I' + srcdir],
+                                          no_extern_c=True)
+    sizes = np.zeros(len(type_names), dtype=np.uint32)
+    module.get_function('get_struct_sizes')(cuda.Out(sizes),
+                                            block=(1,1,1), grid=(1,1))
+
+    return dict(zip(type_names, [int(size) for size in sizes]))
+
 class GPUFuncs(object):
     """Simple container class for GPU functions as attributes."""
     def __init__(self, module):
@@ -83,18 +108,64 @@ def get_rng_states(size, seed=1):
 
     return rng_states
 
-def to_float3(arr):
-    "Returns an pycuda.gpuarray.vec.float3 array from an (N,3) array."
+def to_float3(arr, out=None):
+    """Returns an pycuda.gpuarray.vec.float3 array from an (N,3) array.
+    If given, the values are cast directly into the float3 array `out`."""
+    if out is not None:
+        out.view(np.float32).reshape(-1,3)[:] = arr
+        return out
     if not arr.flags['C_CONTIGUOUS']:
         arr = np.asarray(arr, order='c')
     return arr.astype(np.float32).view(ga.vec.float3)[:,0]
 
-def to_uint3(arr):
-    "Returns a pycuda.gpuarray.vec.uint3 array from an (N,3) array."
+def to_uint3(arr, out=None):
+    """Returns a pycuda.gpuarray.vec.uint3 array from an (N,3) array.
+    If given, the values are cast directly into the uint3 array `out`."""
+    if out is not None:
+        out.view(np.uint32).reshape(-1,3)[:] = arr
+        return out
     if not arr.flags['C_CONTIGUOUS']:
         arr = np.asarray(arr, order='c')
     return arr.astype(np.uint32).view(ga.vec.uint3)[:,0]
 
+def to_aosoa32(triangles, material_codes=None, out=None):
+    """Returns the (N,3) array `triangles` and the N `material_codes`
+    interleaved into tiles of 32 triangles, as a uint32 array of shape
+    (ceil(N/32),4,32). Tile i holds the three vertex indices followed by
+    the material codes of triangles 32*i to 32*i+31, so that a warp reads
+    each field of its triangles with one coalesced load. The last tile is
+    padded with zeros, as are the material codes if `material_codes` is
+    None. If given, the tiles are written into `out`.
+
+    Example:
+        >>> to_aosoa32(np.arange(6).reshape(2,3), [7,8])[0,:,:3]
+        array([[0, 3, 0],
+               [1, 4, 0],
+               [2, 5, 0],
+               [7, 8, 0]], dtype=uint32)
+    """
+    n = len(triangles)
+    ntiles = (n + 31) // 32
+    if out is None:
+        out = np.empty((ntiles,4,32), dtype=np.uint32)
+    elif out.shape != (ntiles,4,32):
+        raise ValueError('`out` must have shape %s.' % ((ntiles,4,32),))
+
+    nfull, rem = divmod(n, 32)
+    columns = [triangles[:,0], triangles[:,1], triangles[:,2]]
+    if material_codes is None:
+        out[:,3,:] = 0
+    else:
+        columns.append(material_codes)
+
+    for i, column in enumerate(columns):
+        out[:nfull,i,:] = np.reshape(column[:nfull*32], (nfull,32))
+        if rem:
+            out[nfull,i,:rem] = column[nfull*32:]
+            out[nfull,i,rem:] = 0
+
+    return out
+
 def chunk_iterator(nelements, nthreads_per_block=64, max_blocks=1024):
     """Iterator that yields tuples with the values requried to process
     a long array in multiple kernel passes on the GPU.
@@ -118,6 +189,45 @@ def chunk_iterator(nelements, nthreads_per_block=64, max_blocks=1024):
         yield (first, elements_this_round, blocks)
         first += elements_this_round
 
+def max_occupancy_config(function):
+    """Returns the (nthreads_per_block, max_blocks) that fully occupy the
+    current device with the kernel `function`.
+
+    nthreads_per_block is the power of two block size that gives the most
+    resident threads per multiprocessor given the thread, block and
+    register limits (the smallest such size in case of a tie), and
+    max_blocks is the number of those blocks resident on the whole device
+    at once."""
+    device = cuda.Context.get_device()
+    attr = cuda.device_attribute
+    warp_size = device.get_attribute(attr.WARP_SIZE)
+    nmultiprocessors = device.get_attribute(attr.MULTIPROCESSOR_COUNT)
+    max_threads = device.get_attribute(attr.MAX_THREADS_PER_MULTIPROCESSOR)
+    max_registers = device.get_attribute(attr.MAX_REGISTERS_PER_MULTIPROCESSOR)
+    if hasattr(attr, 'MAX_BLOCKS_PER_MULTIPROCESSOR'):
+        max_blocks = device.get_attribute(attr.MAX_BLOCKS_PER_MULTIPROCESSOR)
+    else:
+        max_blocks = 16 # lowest limit of the architectures that lack it
+
+    max_block_size = \
+        function.get_attribute(cuda.function_attribute.MAX_THREADS_PER_BLOCK)
+    nregisters = \
+        max(1, function.get_attribute(cuda.function_attribute.NUM_REGS))
+
+    best = None
+    block_size = warp_size
+    while block_size <= max_block_size:
+        blocks_per_multiprocessor = min(max_blocks,
+                                        max_threads // block_size,
+                                        max_registers // (nregisters*block_size))
+        resident_threads = blocks_per_multiprocessor * block_size
+        if best is None or resident_threads > best[0]:
+            best = (resident_threads, block_size, blocks_per_multiprocessor)
+        block_size *= 2
+
+    resident_threads, block_size, blocks_per_multiprocessor = best
+    return block_size, max(1, blocks_per_multiprocessor * nmultiprocessors)
+
 def create_cuda_context(device_id=None):
     """Initialize and return a CUDA context on the specified device.
     If device_id is None, the default device is used."""
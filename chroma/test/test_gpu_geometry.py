@@ -0,0 +1,93 @@
+from .unittest_find import unittest
+import numpy as np
+from numpy.testing import assert_allclose
+
+from chroma.geometry import standard_wavelengths
+from chroma.gpu.geometry import _interp_batch, _to_unorm16, _uniform_step
+from chroma.gpu.tools import to_aosoa32
+
+class TestInterpBatch(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        self.props = []
+        for n in [1, 2, 5, 17]:
+            xp = np.sort(np.random.uniform(100, 900, n))
+            fp = np.random.uniform(0, 5, n)
+            self.props.append(np.array(list(zip(xp, fp)), dtype=np.float32))
+        # several tables on the same abscissa are interpolated together
+        for value in [1.0, 1.33, 1e6]:
+            fp = np.tile(value, len(standard_wavelengths))
+            self.props.append(np.array(list(zip(standard_wavelengths, fp)),
+                                       dtype=np.float32))
+
+    def test_matches_interp(self):
+        '''Batched interpolation agrees with np.interp()'''
+        result = _interp_batch(standard_wavelengths, self.props)
+        self.assertEqual(result.shape,
+                         (len(self.props), len(standard_wavelengths)))
+        self.assertEqual(result.dtype, np.float32)
+
+        for row, prop in zip(result, self.props):
+            expected = np.interp(standard_wavelengths, prop[:,0], prop[:,1])
+            assert_allclose(row, expected, rtol=1e-6)
+
+    def test_empty(self):
+        result = _interp_batch(standard_wavelengths, [])
+        self.assertEqual(result.shape, (0, len(standard_wavelengths)))
+
+class TestUnorm16(unittest.TestCase):
+    def test_round_trip(self):
+        '''Fractions are stored to within half a step'''
+        x = np.linspace(0, 1, 1001)
+        result = _to_unorm16(x)
+        self.assertEqual(result.dtype, np.uint16)
+        self.assertTrue(np.all(np.abs(result/65535.0 - x) <= 0.5/65535))
+
+    def test_clipping(self):
+        result = _to_unorm16(np.array([-0.5, 0.0, 1.0, 1.5]))
+        np.testing.assert_equal(result, [0, 0, 65535, 65535])
+
+    def test_sum_to_one(self):
+        '''Fractions summing to one along `axis` still sum to 65535'''
+        np.random.seed(0)
+        # (surfaces, probabilities, wavelengths)
+        x = np.random.dirichlet(np.ones(4), size=(20,60)).transpose(0,2,1)
+        x = np.concatenate([x, np.tile([[[0.3],[0.3],[0.4],[0.0]]], (1,1,60))])
+        result = _to_unorm16(x.astype(np.float32), axis=1)
+        self.assertEqual(result.dtype, np.uint16)
+        np.testing.assert_equal(result.sum(axis=1, dtype=np.int64), 65535)
+        self.assertTrue(np.all(np.abs(result/65535.0 - x) <= 1.0/65535))
+
+class TestUniformStep(unittest.TestCase):
+    def test_step(self):
+        self.assertEqual(_uniform_step(standard_wavelengths, 'wavelengths'),
+                         standard_wavelengths[1] - standard_wavelengths[0])
+
+    def test_rounding(self):
+        '''Rounding in the spacing of an np.arange() grid is tolerated'''
+        self.assertAlmostEqual(_uniform_step(np.arange(0,1000,0.05), 'times'),
+                               0.05)
+
+    def test_unequal(self):
+        self.assertRaises(ValueError, _uniform_step, np.array([1.0, 2.0, 4.0]),
+                          'times')
+        self.assertRaises(ValueError, _uniform_step, np.array([1.0]), 'times')
+
+class TestAoSoA32(unittest.TestCase):
+    def test_layout(self):
+        '''Each triangle's fields are 32 entries apart in its tile'''
+        for n in [1, 31, 32, 33, 100]:
+            triangles = np.random.randint(0, 1000, size=(n,3))
+            material_codes = np.random.randint(0, 2**31, size=n)
+            tiles = to_aosoa32(triangles, material_codes)
+            self.assertEqual(tiles.shape, ((n+31)//32, 4, 32))
+
+            flat = tiles.reshape(-1)
+            index = (np.arange(n)//32)*128 + np.arange(n)%32
+            for i in range(3):
+                np.testing.assert_equal(flat[index + 32*i], triangles[:,i])
+            np.testing.assert_equal(flat[index + 96], material_codes)
+
+            # padding
+            self.assertEqual(flat.sum(),
+                             triangles.sum() + material_codes.sum())